@@ -12,22 +12,30 @@ Environment:
 - `LMSTUDIO_BASE` is fixed here to a local server; adjust if needed.
 - `EMBED_MODEL` can be overridden via environment.
 
+The OpenAI client (and the `openai` import) is created lazily on first use so
+importing this module stays cheap at startup.
+
 Used by:
 - `ingest.build_index` for document embeddings
-- `rag.search_diverse` via `embed_queries`
+- `rag.search_diverse` / `rag.search_shards` via `embed_queries`
 - `rag.mmr` via `embed_texts`
+- `ingest.build_index` / `rag.search_diverse` via `truncate_vectors` (coarse index)
 """
 
-from openai import OpenAI
 import numpy as np
 import os
+import threading
+from functools import lru_cache
 from typing import Optional, List, Tuple
 
 LMSTUDIO_BASE = "http://192.168.1.2:1234/v1"
 # Set this to the EXACT id shown by /v1/models in LM Studio
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-qwen3-embedding-0.6b")
 
-client = OpenAI(base_url=LMSTUDIO_BASE, api_key="lm-studio")
+@lru_cache(maxsize=None)
+def get_client():
+    from openai import OpenAI  # heavy import, deferred until the first request
+    return OpenAI(base_url=LMSTUDIO_BASE, api_key="lm-studio")
 
 # --- Qwen3 prompt emulation (see model card: use prompt_name="query" for queries) ---
 QUERY_PREFIX = "query: "
@@ -44,7 +52,7 @@ def prep_doc(text: str, title: Optional[str] = None) -> str:
 
 def debug_list_models() -> None:
     try:
-        ms = client.models.list()
+        ms = get_client().models.list()
         print("LM Studio models available:")
         for m in ms.data:
             print(" -", m.id)
@@ -52,8 +60,14 @@ def debug_list_models() -> None:
     except Exception as e:
         print("Could not list models:", e)
 
+def debug_list_models_async() -> threading.Thread:
+    """Run `debug_list_models` on a daemon thread so startup never blocks on it."""
+    t = threading.Thread(target=debug_list_models, name="lms-model-probe", daemon=True)
+    t.start()
+    return t
+
 def _embed_raw(texts: List[str]) -> np.ndarray:
-    resp = client.embeddings.create(model=EMBED_MODEL, input=texts)
+    resp = get_client().embeddings.create(model=EMBED_MODEL, input=texts)
     vecs = [d.embedding for d in resp.data]
     return np.asarray(vecs, dtype="float32")
 
@@ -72,3 +86,14 @@ def embed_docs(titled_chunks: List[Tuple[Optional[str], str]]) -> np.ndarray:
     for Qwen3 embeddings; including it can sometimes help retrieval.
     """
     return _embed_raw([prep_doc(text, title) for title, text in titled_chunks])
+
+def truncate_vectors(X: np.ndarray, dim: int) -> np.ndarray:
+    """Truncate embeddings to their first `dim` components and re-normalize.
+
+    Qwen3 embeddings are Matryoshka-trained: the leading dimensions carry most
+    of the signal, so truncated vectors work well for a coarse first pass.
+    """
+    T = np.ascontiguousarray(X[:, :dim], dtype="float32")
+    norms = np.linalg.norm(T, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return T / norms
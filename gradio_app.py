@@ -2,12 +2,20 @@
 Gradio Web UI for the local RAG system (autoimmune liver diseases: AIH, PBC, PSC).
 
 Features:
-- Upload/list PDFs and build or load cached FAISS index.
+- Upload/list PDFs and build or load cached FAISS indexes; several comma-separated
+  folders become separate collections, each with its own cache and manifest.
+- Search the selected collections in parallel and merge their hits.
 - Ask questions with diversification and optional MMR re-ranking.
+- Restrict retrieval by file, page range or document tag (applied inside FAISS).
 - Shows answer and the list of cited source labels.
+- Follow-up mode: a per-browser session reuses earlier evidence and chat turns.
 
 Uses `ingest` for indexing, `rag` for retrieval and prompt building,
 and `llm_lms.generate_answer` with a clinical prompt oriented to AIH/PBC/PSC.
+
+Startup: the LM Studio model probe and a cache-only warm load of the default
+collection run in the background while gradio itself is imported, so the UI
+comes up without waiting on either. Startup time is printed.
 """
 
 import os
@@ -17,54 +25,74 @@ import pickle
 import time
 import glob
 import hashlib
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-import gradio as gr
-import faiss
+T0 = time.perf_counter()  # startup clock
 
 # --- your modules ---
-from ingest import build_index  # builds FAISS + returns (index, chunks, meta)
-from rag import search_diverse, make_prompt, mmr
+from ingest import build_index, load_doc_tags  # builds FAISS + returns (index, chunks, meta, vectors)
+from rag import search_shards, combine_shards, make_prompt, mmr, filter_ids, parse_pages, load_defaults
 from llm_lms import generate_answer
+from session import (
+    new_session, retrieval_query, usable_ids, select_evidence, build_turn_prompt, record_turn, history,
+)
 from embedder_lms import (
-    debug_list_models,
+    debug_list_models_async,
     EMBED_MODEL,
     embed_queries,  # query embeddings with Qwen prompts
     embed_texts,    # doc embeddings (used by MMR)
 )
 
-# ---- cache paths (same as main.py) ----
+# ---- cache paths (same as main.py): one sub-directory per collection ----
 CACHE_DIR = ".cache"
-INDEX_PATH = os.path.join(CACHE_DIR, "index.faiss")
-CHUNKS_PATH = os.path.join(CACHE_DIR, "chunks.pkl")
-META_PATH = os.path.join(CACHE_DIR, "meta.pkl")
-MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
 
 # bump when you change embed prompts/strategy
 PROMPTS_VERSION = "qwen3-v2"
 
 # ---- globals ----
-G_INDEX = None
-G_CHUNKS = None
+G_SHARDS = {}     # {collection name: shard dict (index, chunks, meta, vectors, manifest, doc_tags)}
+G_CHUNKS = None   # combined over all loaded shards (global ids, see rag.combine_shards)
 G_META = None
-G_MANIFEST = None
+G_DOC_TAGS = {}   # {basename: [tags]} merged from each <folder>/tags.json
+G_WARM = None     # Future of the background warm start (see warm_start)
+G_GENERATION = 0  # bumped on every (re)load; sessions from older generations are reset
+G_LOCK = threading.Lock()  # guards installing a new set of shards (user load vs warm start)
+D = load_defaults()  # slider defaults, same source as main.py (rag_defaults.json from tune.py)
 
 
 # ---------- helpers ----------
 def scan_pdfs(folder: str):
     return sorted(glob.glob(os.path.join(folder, "*.pdf")))
 
+def split_folders(folders: str):
+    return [f.strip() for f in (folders or "").split(",") if f.strip()]
+
+def collection_name(folder: str):
+    return os.path.basename(os.path.normpath(folder))
+
+def cache_paths(cache_dir):
+    return {
+        "index": os.path.join(cache_dir, "index.faiss"),
+        "chunks": os.path.join(cache_dir, "chunks.pkl"),
+        "meta": os.path.join(cache_dir, "meta.pkl"),
+        "manifest": os.path.join(cache_dir, "manifest.json"),
+        "vectors": os.path.join(cache_dir, "vectors.npy"),
+    }
+
 def file_fingerprint(path: str):
     st = os.stat(path)
     return {"path": os.path.abspath(path), "mtime": st.st_mtime_ns, "size": st.st_size}
 
-def compute_manifest(pdf_paths, chunk_size, overlap):
+def compute_manifest(pdf_paths, chunk_size, overlap, coarse_dim=0):
     return {
         "timestamp": time.time(),
         "embed_model": EMBED_MODEL,
         "prompts_version": PROMPTS_VERSION,
         "chunk_size": chunk_size,
         "overlap": overlap,
+        "coarse_dim": coarse_dim,
         "files": [file_fingerprint(p) for p in pdf_paths],
         "digest": None,
     }
@@ -75,31 +103,46 @@ def digest_manifest(m):
     h.update(m["prompts_version"].encode())
     h.update(str(m["chunk_size"]).encode())
     h.update(str(m["overlap"]).encode())
+    if m.get("coarse_dim"):
+        h.update(f"coarse_dim={m['coarse_dim']}".encode())
     for f in m["files"]:
         h.update(f["path"].encode())
         h.update(str(f["mtime"]).encode())
         h.update(str(f["size"]).encode())
     return h.hexdigest()
 
-def load_cached():
-    if not (os.path.exists(INDEX_PATH) and os.path.exists(CHUNKS_PATH)
-            and os.path.exists(META_PATH) and os.path.exists(MANIFEST_PATH)):
+def load_cached(cache_dir):
+    P = cache_paths(cache_dir)
+    if not all(os.path.exists(P[k]) for k in ("index", "chunks", "meta", "manifest")):
         return None
+    import faiss
+    import numpy as np
     try:
-        ix = faiss.read_index(INDEX_PATH)
-        with open(CHUNKS_PATH, "rb") as f: ch = pickle.load(f)
-        with open(META_PATH, "rb") as f: mt = pickle.load(f)
-        with open(MANIFEST_PATH, "r") as f: mf = json.load(f)
-        return {"index": ix, "chunks": ch, "meta": mt, "manifest": mf}
+        ix = faiss.read_index(P["index"])
+        with open(P["chunks"], "rb") as f: ch = pickle.load(f)
+        with open(P["meta"], "rb") as f: mt = pickle.load(f)
+        with open(P["manifest"], "r") as f: mf = json.load(f)
+        vx = np.load(P["vectors"], mmap_mode="r") if mf.get("coarse_dim") else None
+        return {"index": ix, "chunks": ch, "meta": mt, "manifest": mf, "vectors": vx}
     except Exception:
         return None
 
-def save_cache(index, chunks, meta, manifest):
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    faiss.write_index(index, INDEX_PATH)
-    with open(CHUNKS_PATH, "wb") as f: pickle.dump(chunks, f)
-    with open(META_PATH, "wb") as f: pickle.dump(meta, f)
-    with open(MANIFEST_PATH, "w") as f: json.dump(manifest, f, indent=2)
+def save_cache(cache_dir, index, chunks, meta, manifest, vectors=None):
+    """Persist a collection; returns the full-dim vectors re-opened memory-mapped (or None)."""
+    import faiss
+    import numpy as np
+    P = cache_paths(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    faiss.write_index(index, P["index"])
+    with open(P["chunks"], "wb") as f: pickle.dump(chunks, f)
+    with open(P["meta"], "wb") as f: pickle.dump(meta, f)
+    with open(P["manifest"], "w") as f: json.dump(manifest, f, indent=2)
+    if vectors is not None:
+        np.save(P["vectors"], vectors)
+        return np.load(P["vectors"], mmap_mode="r")
+    if os.path.exists(P["vectors"]):
+        os.remove(P["vectors"])
+    return None
 
 def _label(m):
     if isinstance(m, dict):
@@ -110,19 +153,20 @@ def _label(m):
 
 
 # ---------- gradio callbacks ----------
-def list_pdfs(folder):
-    """List PDFs in the target folder for display."""
+def list_pdfs(folders):
+    """List PDFs in the target folder(s) for display."""
     try:
-        pdfs = scan_pdfs(folder)
+        pdfs = [p for folder in split_folders(folders) for p in scan_pdfs(folder)]
         return "\n".join(pdfs) if pdfs else "(no PDFs found)"
     except Exception as e:
         return f"Error listing PDFs: {e}"
 
-def add_uploads_to_folder(files, folder):
-    """Save uploaded files into the PDF folder."""
+def add_uploads_to_folder(files, folders):
+    """Save uploaded files into the (first) PDF folder."""
     if not files:
         return "No files uploaded."
     try:
+        folder = (split_folders(folders) or ["pdfs"])[0]
         os.makedirs(folder, exist_ok=True)
         added = []
         for f in files:
@@ -133,66 +177,185 @@ def add_uploads_to_folder(files, folder):
     except Exception as e:
         return f"Upload failed: {e}"
 
-def ensure_index(folder, chunk_size, overlap, force_rebuild=False):
+def load_shard(folder, chunk_size, overlap, force_rebuild=False, coarse_dim=0, cache_only=False):
+    """
+    Build or load one collection from `.cache/<name>/` depending on its manifest.
+    Returns (shard, status line). A shard already in memory with the same
+    digest is reused (as a copy: the live one may be serving queries). With
+    `cache_only`, a stale/missing cache yields (None, status) instead of a rebuild.
+    """
+    name = collection_name(folder)
+    cache_dir = os.path.join(CACHE_DIR, name)
+    pdfs = scan_pdfs(folder)
+    new_m = compute_manifest(pdfs, chunk_size, overlap, int(coarse_dim))
+    new_m["digest"] = digest_manifest(new_m)
+
+    if not force_rebuild:
+        loaded = G_SHARDS.get(name)
+        if loaded and loaded["manifest"].get("digest") == new_m["digest"]:
+            loaded = dict(loaded, doc_tags=load_doc_tags(folder))
+            return loaded, f"✅ [{name}] in memory ({len(pdfs)} PDFs, {len(loaded['chunks'])} chunks)"
+        cached = load_cached(cache_dir)
+        if cached and cached["manifest"].get("digest") == new_m["digest"]:
+            cached.update(name=name, folder=folder, doc_tags=load_doc_tags(folder))
+            return cached, f"✅ [{name}] loaded cached index ({len(pdfs)} PDFs, {len(cached['chunks'])} chunks)"
+
+    if cache_only:
+        return None, f"… [{name}] no matching cached index — click Build/Load Index"
+
+    # rebuild this collection only
+    index, chunks, meta, vectors = build_index(
+        pdfs, chunk_size=chunk_size, overlap=overlap, coarse_dim=int(coarse_dim)
+    )
+    vectors = save_cache(cache_dir, index, chunks, meta, new_m, vectors)
+    shard = {"index": index, "chunks": chunks, "meta": meta, "manifest": new_m, "vectors": vectors,
+             "name": name, "folder": folder, "doc_tags": load_doc_tags(folder)}
+    return shard, f"🔄 [{name}] rebuilt index ({len(pdfs)} PDFs, {len(chunks)} chunks)"
+
+def ensure_index(folders, chunk_size, overlap, force_rebuild=False, coarse_dim=0, cache_only=False,
+                 generation=None):
     """
-    Build or load the index depending on cache + manifest.
-    Only re-embeds when PDFs/params/model changed or when force_rebuild=True.
+    Build or load every collection (comma-separated folders) depending on cache + manifest.
+    Only re-embeds a collection when its PDFs/params/model changed or when force_rebuild=True.
+    `coarse_dim` > 0 builds a truncated first-pass index plus full-dim vectors.
+    `cache_only` loads what is cached and never builds (used by `warm_start`).
+    With `generation`, the result is only installed if no other load happened
+    since that generation (so a late warm start cannot replace a user's Build/Load).
+    Returns (status text, loaded collection names or None on failure); no gradio here,
+    see `build_index_ui`.
     """
-    global G_INDEX, G_CHUNKS, G_META, G_MANIFEST
+    global G_SHARDS, G_CHUNKS, G_META, G_DOC_TAGS, G_GENERATION
     try:
-        pdfs = scan_pdfs(folder)
-        new_m = compute_manifest(pdfs, chunk_size, overlap)
-        new_m["digest"] = digest_manifest(new_m)
-
-        if not force_rebuild:
-            cached = load_cached()
-            if cached and cached["manifest"].get("digest") == new_m["digest"]:
-                G_INDEX, G_CHUNKS, G_META, G_MANIFEST = (
-                    cached["index"], cached["chunks"], cached["meta"], cached["manifest"]
-                )
-                return f"✅ Loaded cached index ({len(pdfs)} PDFs, {len(G_CHUNKS)} chunks)"
-
-        # rebuild
-        G_INDEX, G_CHUNKS, G_META = build_index(
-            pdfs, chunk_size=chunk_size, overlap=overlap
-        )
-        G_MANIFEST = new_m
-        save_cache(G_INDEX, G_CHUNKS, G_META, G_MANIFEST)
-        return f"🔄 Rebuilt index ({len(pdfs)} PDFs, {len(G_CHUNKS)} chunks)"
+        folders = split_folders(folders)
+        names = [collection_name(f) for f in folders]
+        if len(set(names)) != len(names):
+            raise ValueError(f"collection names (folder basenames) must be unique: {names}")
+
+        shards, lines = {}, []
+        for folder in folders:
+            shard, line = load_shard(folder, chunk_size, overlap, force_rebuild, coarse_dim, cache_only)
+            lines.append(line)
+            if shard is not None:
+                shards[shard["name"]] = shard
+        names = list(shards)
+
+        with G_LOCK:
+            if generation is not None and G_GENERATION != generation:
+                return "Skipped: collections were loaded meanwhile.", None
+            chunks, meta = combine_shards(list(shards.values()))  # sets offsets on our copies
+            doc_tags = {}
+            for sh in shards.values():
+                doc_tags.update(sh["doc_tags"])
+            G_SHARDS, G_CHUNKS, G_META, G_DOC_TAGS = shards, chunks, meta, doc_tags
+            G_GENERATION += 1  # global chunk ids may have changed
+        return "\n".join(lines), names
     except Exception as e:
         traceback.print_exc()
-        return f"❌ Indexing failed: {e}"
-
-def ask(query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold):
+        return f"❌ Indexing failed: {e}", None
+
+def build_index_ui(folders, chunk_size, overlap, force_rebuild=False, coarse_dim=0):
+    """Build/Load button: `ensure_index` plus an update for the collection selector."""
+    import gradio as gr
+    status, names = ensure_index(folders, chunk_size, overlap, force_rebuild, coarse_dim)
+    if names is None:
+        return status, gr.update()
+    return status, gr.update(choices=names, value=names)
+
+def warm_start(folders="pdfs", chunk_size=D["chunk_size"], overlap=D["overlap"]):
+    """Load cached collections (UI defaults, never builds) on a background thread."""
+    global G_WARM
+    G_WARM = ThreadPoolExecutor(max_workers=1).submit(
+        ensure_index, folders, chunk_size, overlap, cache_only=True, generation=G_GENERATION
+    )
+    G_WARM.add_done_callback(lambda _: print(f"Warm start done in {time.perf_counter() - T0:.2f}s"))
+
+def index_status():
+    """Page load: status and selector for the collections loaded right now."""
+    import gradio as gr
+    warm = G_WARM.result() if G_WARM is not None else ("", None)
+    with G_LOCK:
+        shards = dict(G_SHARDS)
+    if not shards:
+        return warm[0], gr.update(choices=[], value=[])
+    names = list(shards)
+    lines = [f"✅ [{n}] ready ({len(sh['chunks'])} chunks)" for n, sh in shards.items()]
+    return "\n".join(lines), gr.update(choices=names, value=names)
+
+def ask(query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold,
+        files="", pages="", tags="", collections=None, adaptive=True, session=None):
     """
-    Run a question against the current index with diversification and optional MMR.
+    Run a question against the selected collections with diversification and optional MMR.
+    `files`/`pages`/`tags` restrict the FAISS search itself (see `rag.filter_ids`).
+    With `adaptive`, `fetch_k` is an upper bound and low-confidence queries abstain early.
+    With a `session` (see `session.py`), the question is a follow-up of earlier turns.
     """
-    if G_INDEX is None:
+    if G_WARM is not None and not G_SHARDS:
+        G_WARM.result()  # a query right after launch waits for the warm start
+    with G_LOCK:  # one consistent view, even if a Build/Load runs during the query
+        all_shards, chunks, meta, doc_tags, generation = G_SHARDS, G_CHUNKS, G_META, G_DOC_TAGS, G_GENERATION
+    if not all_shards:
         return "Index not ready. Click Build/Load Index first.", "Sources: —"
     if not query or not query.strip():
         return "Please enter a query.", "Sources: —"
+    if session is not None and session.get("generation") != generation:
+        session.clear()
+        session.update(new_session(), generation=generation)  # ids refer to an older load
 
     try:
-        # 1) recall + diversify
-        q_vec, picks = search_diverse(
-            query, G_INDEX, embed_queries, G_META, fetch_k=int(fetch_k), per_file=int(per_file)
+        shards = [all_shards[n] for n in (collections or []) if n in all_shards]
+        if not shards:
+            return "Select at least one collection to search.", "Sources: —"
+
+        try:
+            page_ranges = parse_pages(pages)
+        except ValueError as e:
+            return f"Pages filter: {e}", "Sources: —"
+        ids = filter_ids(
+            meta,
+            files=(files or "").split(","),
+            pages=page_ranges,
+            tags=(tags or "").split(","),
+            doc_tags=doc_tags,
         )
+        if ids is not None and len(ids) == 0:
+            return "No indexed chunks match the filter.", "Sources: —"
 
-        # abstain on low confidence
+        # adaptive: MMR gets 2*k candidates to diversify, plain top-k needs k
+        target = (int(k) * (2 if bool(use_mmr) else 1)) if bool(adaptive) else None
+
+        # 1) recall (selected shards in parallel) + diversify
+        q_vec, picks = search_shards(
+            retrieval_query(session, query) if session is not None else query,
+            shards, embed_queries, meta, fetch_k=int(fetch_k), per_file=int(per_file), ids=ids,
+            target=target, threshold=float(threshold),
+        )
+
+        # abstain on low confidence (a follow-up can still lean on earlier evidence)
         scores = [s for s, _ in picks]
-        if not scores or max(scores) < float(threshold):
+        has_evidence = session is not None and bool(usable_ids(session, shards, ids))
+        if (not scores or max(scores) < float(threshold)) and not has_evidence:
             return "I don't know based on the provided documents.", "Sources:\n(none above threshold)"
 
+        if session is not None:
+            idxs = select_evidence(
+                session, q_vec, picks, chunks, embed_texts, int(k), bool(use_mmr), float(mmr_lambda),
+                threshold=float(threshold), shards=shards, ids=ids,
+            )
+            prompt, new_ids, labels = build_turn_prompt(session, query, idxs, chunks, meta, _label)
+            ans = generate_answer(prompt, history=history(session))
+            record_turn(session, query, prompt, ans, new_ids)
+            return ans, "Sources:\n" + "\n".join(f" - {lbl}" for lbl in labels)
+
         cand_idxs = [i for _, i in picks]
 
         # 2) MMR (embedding-only re-rank) or simple top-k
         if bool(use_mmr):
-            idxs = mmr(q_vec, cand_idxs, G_CHUNKS, embed_texts, topn=int(k), lambda_mult=float(mmr_lambda))
+            idxs = mmr(q_vec, cand_idxs, chunks, embed_texts, topn=int(k), lambda_mult=float(mmr_lambda))
         else:
             idxs = cand_idxs[: int(k)]
 
         # 3) build prompt + answer
-        contexts = [(_label(G_META[i]), G_CHUNKS[i]) for i in idxs if i != -1]
+        contexts = [(_label(meta[i]), chunks[i]) for i in idxs if i != -1]
         prompt = make_prompt(query, contexts)
         ans = generate_answer(prompt)
 
@@ -202,9 +365,27 @@ def ask(query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold):
         traceback.print_exc()
         return f"Error during query: {e}", "Sources: —"
 
+def ask_ui(query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold,
+           files, pages, tags, collections, adaptive, follow_up, session):
+    """Gradio wrapper around `ask` that threads the per-browser session state."""
+    args = (query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold, files, pages, tags, collections, adaptive)
+    if not follow_up:
+        return (*ask(*args), session)
+    if session is None or session.get("generation") != G_GENERATION:
+        session = new_session()
+        session["generation"] = G_GENERATION
+    ans, srcs = ask(*args, session=session)
+    return ans, srcs, session
+
+def new_conversation():
+    """Drop the session (evidence + turns) and clear the outputs."""
+    return None, "", ""
+
 
 # ---------- UI ----------
 def build_ui():
+    import gradio as gr  # the heaviest import; warm_start overlaps with it
+
     with gr.Blocks(title="Local RAG — Autoimmune Liver (AIH/PBC/PSC)") as demo:
         gr.Markdown(
             "## Local RAG — Autoimmune Liver Diseases (AIH, PBC, PSC)\n"
@@ -212,7 +393,7 @@ def build_ui():
         )
 
         with gr.Row():
-            folder_in = gr.Textbox(value="pdfs", label="PDF folder path")
+            folder_in = gr.Textbox(value="pdfs", label="PDF folder path(s) (comma-separated = separate collections)")
             btn_list = gr.Button("List PDFs")
         pdf_list = gr.Textbox(label="Found PDFs", lines=6)
 
@@ -221,24 +402,36 @@ def build_ui():
             btn_save = gr.Button("Save uploads to folder")
 
         with gr.Row():
-            chunk_size = gr.Slider(200, 1200, 500, step=50, label="Chunk size")
-            overlap = gr.Slider(0, 400, 100, step=20, label="Overlap")
+            chunk_size = gr.Slider(200, 1200, D["chunk_size"], step=50, label="Chunk size")
+            overlap = gr.Slider(0, 400, D["overlap"], step=20, label="Overlap")
+            coarse_dim = gr.Number(value=0, precision=0, label="Coarse index dim (0 = full, e.g. 256)")
         with gr.Row():
             force_rebuild = gr.Checkbox(label="Force rebuild", value=False)
             btn_build = gr.Button("Build/Load Index")
-        build_status = gr.Textbox(label="Index status")
+        build_status = gr.Textbox(label="Index status", lines=3)
 
         gr.Markdown("### Ask")
         query = gr.Textbox(label="Query", placeholder="e.g., initial steroid regimen for AIH flare?", lines=2)
 
         with gr.Row():
-            k = gr.Slider(1, 8, 3, step=1, label="k (final contexts)")
-            fetch_k = gr.Slider(10, 200, 80, step=10, label="FAISS candidates (fetch_k)")
-            per_file = gr.Slider(1, 5, 2, step=1, label="Max per file (diversify)")
+            k = gr.Slider(1, 8, D["k"], step=1, label="k (final contexts)")
+            fetch_k = gr.Slider(10, 200, D["fetch_k"], step=10, label="FAISS candidates (fetch_k, max when adaptive)")
+            per_file = gr.Slider(1, 5, D["per_file"], step=1, label="Max per file (diversify)")
         with gr.Row():
             use_mmr = gr.Checkbox(value=True, label="Use MMR")
-            mmr_lambda = gr.Slider(0.5, 0.95, 0.7, step=0.05, label="MMR lambda (relevance vs diversity)")
-            threshold = gr.Slider(0.0, 0.9, 0.25, step=0.05, label="Similarity threshold (abstain below)")
+            adaptive = gr.Checkbox(value=True, label="Adaptive fetch_k")
+            mmr_lambda = gr.Slider(0.5, 0.95, D["mmr_lambda"], step=0.05, label="MMR lambda (relevance vs diversity)")
+            threshold = gr.Slider(0.0, 0.9, D["threshold"], step=0.05, label="Similarity threshold (abstain below)")
+        collections_sel = gr.CheckboxGroup(choices=[], label="Search collections")
+        with gr.Row():
+            files_f = gr.Textbox(label="Restrict to files (comma-separated, substring match)", placeholder="e.g., PIIS0168827825001734")
+            pages_f = gr.Textbox(label="Pages", placeholder="e.g., 1-10, 15")
+            tags_f = gr.Textbox(label="Tags (all must match, from tags.json)", placeholder="e.g., pbc, adult")
+
+        with gr.Row():
+            follow_up = gr.Checkbox(value=False, label="Follow-up mode (reuse evidence from earlier questions)")
+            btn_new = gr.Button("New conversation")
+        session_state = gr.State(None)
 
         btn_ask = gr.Button("Ask")
         answer = gr.Textbox(label="Answer", lines=10)
@@ -248,21 +441,27 @@ def build_ui():
         btn_list.click(list_pdfs, inputs=folder_in, outputs=pdf_list)
         btn_save.click(add_uploads_to_folder, inputs=[upload, folder_in], outputs=build_status)
         btn_build.click(
-            ensure_index,
-            inputs=[folder_in, chunk_size, overlap, force_rebuild],
-            outputs=build_status
+            build_index_ui,
+            inputs=[folder_in, chunk_size, overlap, force_rebuild, coarse_dim],
+            outputs=[build_status, collections_sel]
         )
         btn_ask.click(
-            ask,
-            inputs=[query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold],
-            outputs=[answer, sources]
+            ask_ui,
+            inputs=[query, k, fetch_k, per_file, use_mmr, mmr_lambda, threshold,
+                    files_f, pages_f, tags_f, collections_sel, adaptive, follow_up, session_state],
+            outputs=[answer, sources, session_state]
         )
+        btn_new.click(new_conversation, outputs=[session_state, answer, sources])
+
+        demo.load(index_status, outputs=[build_status, collections_sel])
 
         return demo
 
 
 if __name__ == "__main__":
-    # Print LM Studio models + try warm-loading cache on startup for nice UX
-    debug_list_models()
+    # Print LM Studio models + warm-load the cache in the background for nice UX
+    debug_list_models_async()
+    warm_start("pdfs")
     app = build_ui()
+    print(f"UI built in {time.perf_counter() - T0:.2f}s")
     app.launch()
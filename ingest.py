@@ -7,20 +7,24 @@ Workflow:
 - `load_pdfs` extracts text per page for each PDF.
 - `chunk_page` splits pages into overlapping word windows.
 - `build_index` embeds all chunks and builds a normalized inner-product FAISS index.
+- `load_doc_tags` reads optional per-document tags (`tags.json` in the PDF folder)
+  used by `rag.filter_ids`; tags are resolved at query time and never force a rebuild.
 
 Outputs:
 - `index`: FAISS `IndexFlatIP` (on L2-normalized vectors)
 - `chunks`: list[str] of chunk texts aligned with index ids
 - `meta`: list[dict] with `{"title": <path>, "page": <int>}` aligned with chunks
+- `vectors`: full-dimension vectors when a coarse (truncated) index is built, else None
 
-Used by `main.py` and `gradio_app.py` for retrieval.
+Used by `main.py` and `gradio_app.py` for retrieval. `pypdf` and `faiss` are
+imported inside the functions that need them, so loading a cached index never
+pays for the PDF stack.
 """
 
-from pypdf import PdfReader
 import os
-import faiss
+import json
 from typing import List, Tuple, Dict
-from embedder_lms import embed_docs
+from embedder_lms import embed_docs, truncate_vectors
 
 def load_pdfs(paths: List[str]) -> List[Dict]:
     """Load PDFs and extract text per page.
@@ -28,6 +32,8 @@ def load_pdfs(paths: List[str]) -> List[Dict]:
     Returns a list of dicts: {"title": path, "pages": [{"page": 1, "text": ...}, ...]}
     Pages without extractable text are skipped.
     """
+    from pypdf import PdfReader
+
     docs: List[Dict] = []
     for p in paths:
         reader = PdfReader(p)
@@ -40,6 +46,24 @@ def load_pdfs(paths: List[str]) -> List[Dict]:
             docs.append({"title": p, "pages": pages})
     return docs
 
+def load_doc_tags(folder: str) -> Dict[str, List[str]]:
+    """Load `<folder>/tags.json`: {"file.pdf": ["pbc", "easl", "en", "adult"], ...}.
+
+    Keys are PDF basenames; tags are lower-cased. Returns {} if the file is missing.
+    Raises ValueError naming the file if it is not an object of tag lists.
+    """
+    path = os.path.join(folder, "tags.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        raw = json.load(f)
+    if not isinstance(raw, dict):
+        raise ValueError(f"{path}: expected an object {{\"file.pdf\": [tags]}}, got {type(raw).__name__}")
+    for k, v in raw.items():
+        if not isinstance(v, list):
+            raise ValueError(f"{path}: tags for {k!r} must be a list, got {type(v).__name__}")
+    return {os.path.basename(k): [str(t).lower() for t in v] for k, v in raw.items()}
+
 def chunk_page(text: str, size: int = 500, overlap: int = 100) -> List[str]:
     """Split page text into overlapping word-based chunks.
 
@@ -50,8 +74,25 @@ def chunk_page(text: str, size: int = 500, overlap: int = 100) -> List[str]:
     step = max(1, size - overlap)
     return [" ".join(words[i:i+size]) for i in range(0, len(words), step)]
 
-def build_index(pdf_paths: List[str], chunk_size: int = 500, overlap: int = 100):
-    """Build embeddings and FAISS index for a set of PDFs."""
+def build_index(pdf_paths: List[str], chunk_size: int = 500, overlap: int = 100, coarse_dim: int = 0):
+    """Build embeddings and FAISS index for a set of PDFs.
+
+    With `coarse_dim` > 0 (and below the model dimension) the FAISS index holds
+    Matryoshka-truncated vectors for a cheap first pass; the full-dimension
+    vectors are returned separately so `rag.search_diverse` can rescore the
+    top candidates exactly. Raises ValueError for a `coarse_dim` that is
+    negative or not below the model dimension (checked before embedding the
+    corpus), so an unusable setting never ends up in a cache manifest.
+    """
+    import faiss
+
+    if coarse_dim < 0:
+        raise ValueError(f"coarse_dim must be >= 0, got {coarse_dim}")
+    if coarse_dim:
+        dim = embed_docs([(None, "dimension probe")]).shape[1]
+        if coarse_dim >= dim:
+            raise ValueError(f"coarse_dim must be below the embedding dimension ({dim}), got {coarse_dim}")
+
     docs = load_pdfs(pdf_paths)
     chunks: List[str] = []
     meta: List[Dict] = []
@@ -66,6 +107,10 @@ def build_index(pdf_paths: List[str], chunk_size: int = 500, overlap: int = 100)
 
     X = embed_docs(titled_chunks)
     faiss.normalize_L2(X)
+    if coarse_dim:
+        index = faiss.IndexFlatIP(coarse_dim)
+        index.add(truncate_vectors(X, coarse_dim))
+        return index, chunks, meta, X
     index = faiss.IndexFlatIP(X.shape[1])
     index.add(X)
-    return index, chunks, meta
+    return index, chunks, meta, None
@@ -13,16 +13,21 @@ Connections:
 Environment:
 - `LMSTUDIO_BASE` (optional): override LM Studio base URL.
 - `LLM_MODEL` (optional): override chat model id as shown by LM Studio.
+
+The client is created lazily on the first request (see `embedder_lms.get_client`).
 """
 
-from openai import OpenAI
 import os
+from functools import lru_cache
 
 # Allow overriding via environment; fall back to common defaults
 LMSTUDIO_BASE = os.environ.get("LMSTUDIO_BASE", "http://192.168.1.2:1234/v1")
 LLM_MODEL = os.environ.get("LLM_MODEL", "qwen/qwen3-1.7b")
 
-client = OpenAI(base_url=LMSTUDIO_BASE, api_key="lm-studio")
+@lru_cache(maxsize=None)
+def get_client():
+    from openai import OpenAI  # heavy import, deferred until the first request
+    return OpenAI(base_url=LMSTUDIO_BASE, api_key="lm-studio")
 
 # Domain-specific system prompt for autoimmune liver clinical support
 SYSTEM_PROMPT_AUTOIMMUNE_LIVER = (
@@ -54,18 +59,21 @@ SYSTEM_PROMPT_AUTOIMMUNE_LIVER = (
 )
 
 
-def generate_answer(prompt: str, temperature: float = 0.3) -> str:
+def generate_answer(prompt: str, temperature: float = 0.3, history=None) -> str:
     """Call LM Studio to generate an answer using the autoimmune liver prompt.
 
     Parameters
     - prompt: The user content built by `rag.make_prompt`, which already
       includes the question and the retrieved SOURCES.
     - temperature: Sampling temperature (default 0.3 for consistency).
+    - history: Earlier user/assistant messages of a session (see `session.py`),
+      sent verbatim after the system prompt so the prefix stays cacheable.
     """
-    r = client.chat.completions.create(
+    r = get_client().chat.completions.create(
         model=LLM_MODEL,
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT_AUTOIMMUNE_LIVER},
+            *(history or []),
             {"role": "user", "content": prompt},
         ],
         temperature=temperature,
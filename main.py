@@ -7,29 +7,57 @@ Clinical focus:
 - Primary Sclerosing Cholangitis (PSC)
 
 Workflow:
-1) Scan guideline/consensus PDFs in `--folder`.
-2) Build or load cached FAISS index (with manifest-based invalidation).
+1) Scan guideline/consensus PDFs in `--folder` (or in each of `--collections`).
+2) Build or load each collection's cached FAISS index (with manifest-based
+   invalidation per collection, so one collection never forces another to rebuild).
 3) For each query: retrieve, diversify, optionally MMR re-rank, construct prompt,
    and call the chat model via `llm_lms.generate_answer`.
+   `--files/--pages/--tags` restrict retrieval inside the FAISS search
+   (tags come from an optional `tags.json` in each collection folder) and
+   `--search` picks the collections to query; they are searched in parallel.
+   With `--session`, follow-up questions reuse the evidence and chat history of
+   earlier turns (see `session.py`).
 
-Artifacts are cached to `.cache/` (index, chunks, metadata, manifest).
+Artifacts are cached per collection to `.cache/<collection>/` (index, chunks,
+metadata, manifest, and the full-dimension vectors when a coarse `--coarse_dim`
+index is used). A collection is named after its folder's basename.
+
+Startup: heavy modules (faiss, pypdf, openai) are imported only when needed, the
+LM Studio model probe runs on a background thread, and collections are loaded
+on a thread pool while `--ask_once` embeds its question concurrently. The time
+to ready is printed.
 
 Safety: Answers are generated strictly from your PDFs with page-level citations; the
 tool supports clinician decision-making but does not replace medical judgment.
 """
 
 import argparse, glob, json, os, pickle, time, hashlib
-import faiss
-from ingest import build_index
-from embedder_lms import debug_list_models, EMBED_MODEL, embed_queries, embed_texts
+from concurrent.futures import ThreadPoolExecutor
+
+T0 = time.perf_counter()  # startup clock, reported once the index is ready
+
+from ingest import build_index, load_doc_tags
+from embedder_lms import debug_list_models_async, EMBED_MODEL, embed_queries, embed_texts
 from llm_lms import generate_answer
-from rag import search_diverse, make_prompt, mmr
+from rag import search_shards, combine_shards, make_prompt, mmr, filter_ids, parse_pages, load_defaults
+from session import (
+    new_session, retrieval_query, usable_ids, select_evidence, build_turn_prompt, record_turn, history,
+)
 
 CACHE_DIR = ".cache"
-INDEX_PATH = os.path.join(CACHE_DIR, "index.faiss")
-CHUNKS_PATH = os.path.join(CACHE_DIR, "chunks.pkl")
-META_PATH = os.path.join(CACHE_DIR, "meta.pkl")
-MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+
+def cache_paths(cache_dir):
+    """Artifact paths inside one collection's cache directory."""
+    return {
+        "index": os.path.join(cache_dir, "index.faiss"),
+        "chunks": os.path.join(cache_dir, "chunks.pkl"),
+        "meta": os.path.join(cache_dir, "meta.pkl"),
+        "manifest": os.path.join(cache_dir, "manifest.json"),
+        "vectors": os.path.join(cache_dir, "vectors.npy"),
+    }
+
+def collection_name(folder: str):
+    return os.path.basename(os.path.normpath(folder))
 
 def scan_pdfs(folder: str):
     """Return sorted list of PDF paths in a folder."""
@@ -39,13 +67,14 @@ def file_fingerprint(path: str):
     st = os.stat(path)
     return {"path": os.path.abspath(path), "mtime": st.st_mtime_ns, "size": st.st_size}
 
-def compute_manifest(pdf_paths, chunk_size, overlap):
+def compute_manifest(pdf_paths, chunk_size, overlap, coarse_dim=0):
     """Compute a manifest that includes inputs affecting the index."""
     return {
         "timestamp": time.time(),
         "embed_model": EMBED_MODEL,
         "chunk_size": chunk_size,
         "overlap": overlap,
+        "coarse_dim": coarse_dim,
         "files": [file_fingerprint(p) for p in pdf_paths],
         "digest": None,  # filled below
     }
@@ -56,37 +85,81 @@ def digest_manifest(m):
     h.update(m["embed_model"].encode())
     h.update(str(m["chunk_size"]).encode())
     h.update(str(m["overlap"]).encode())
+    if m.get("coarse_dim"):  # only hashed when set, so full-dim caches stay valid
+        h.update(f"coarse_dim={m['coarse_dim']}".encode())
     for f in m["files"]:
         h.update(f["path"].encode())
         h.update(str(f["mtime"]).encode())
         h.update(str(f["size"]).encode())
     return h.hexdigest()
 
-def load_cached():
+def load_cached(cache_dir):
     """Load cached index + artifacts if available and consistent."""
-    if not (os.path.exists(INDEX_PATH) and os.path.exists(CHUNKS_PATH) and os.path.exists(META_PATH) and os.path.exists(MANIFEST_PATH)):
+    P = cache_paths(cache_dir)
+    if not all(os.path.exists(P[k]) for k in ("index", "chunks", "meta", "manifest")):
         return None
+    import faiss
+    import numpy as np
     try:
-        index = faiss.read_index(INDEX_PATH)
-        with open(CHUNKS_PATH, "rb") as f: chunks = pickle.load(f)
-        with open(META_PATH, "rb") as f: meta = pickle.load(f)
-        with open(MANIFEST_PATH, "r") as f: manifest = json.load(f)
-        return {"index": index, "chunks": chunks, "meta": meta, "manifest": manifest}
+        index = faiss.read_index(P["index"])
+        with open(P["chunks"], "rb") as f: chunks = pickle.load(f)
+        with open(P["meta"], "rb") as f: meta = pickle.load(f)
+        with open(P["manifest"], "r") as f: manifest = json.load(f)
+        # full-dim vectors are memory-mapped: only rescored rows are paged in
+        vectors = np.load(P["vectors"], mmap_mode="r") if manifest.get("coarse_dim") else None
+        return {"index": index, "chunks": chunks, "meta": meta, "manifest": manifest, "vectors": vectors}
     except Exception:
         return None
 
-def save_cache(index, chunks, meta, manifest):
-    """Persist FAISS index and artifacts to `.cache/`."""
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    faiss.write_index(index, INDEX_PATH)
-    with open(CHUNKS_PATH, "wb") as f: pickle.dump(chunks, f)
-    with open(META_PATH, "wb") as f: pickle.dump(meta, f)
-    with open(MANIFEST_PATH, "w") as f: json.dump(manifest, f, indent=2)
+def save_cache(cache_dir, index, chunks, meta, manifest, vectors=None):
+    """
+    Persist FAISS index and artifacts to `cache_dir`.
+    Returns the full-dim vectors re-opened memory-mapped (or None), so a fresh
+    build does not keep the whole float32 matrix in RAM next to the coarse index.
+    """
+    import faiss
+    import numpy as np
+    P = cache_paths(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    faiss.write_index(index, P["index"])
+    with open(P["chunks"], "wb") as f: pickle.dump(chunks, f)
+    with open(P["meta"], "wb") as f: pickle.dump(meta, f)
+    with open(P["manifest"], "w") as f: json.dump(manifest, f, indent=2)
+    if vectors is not None:
+        np.save(P["vectors"], vectors)
+        return np.load(P["vectors"], mmap_mode="r")
+    if os.path.exists(P["vectors"]):
+        os.remove(P["vectors"])
+    return None
 
 def needs_rebuild(new_manifest, existing_manifest):
     """Return True if cached index is stale vs new manifest inputs."""
     return (existing_manifest is None) or (existing_manifest.get("digest") != new_manifest.get("digest"))
 
+def load_collection(folder, chunk_size, overlap, coarse_dim=0, rebuild=False, cache_root=CACHE_DIR):
+    """Load (or build) one collection's shard from its own `<cache_root>/<name>/`."""
+    name = collection_name(folder)
+    cache_dir = os.path.join(cache_root, name)
+    pdfs = scan_pdfs(folder)
+    print(f"[{name}] Scanning {folder}, found {len(pdfs)} PDFs")
+    new_manifest = compute_manifest(pdfs, chunk_size, overlap, coarse_dim)
+    new_manifest["digest"] = digest_manifest(new_manifest)
+
+    cached = None if rebuild else load_cached(cache_dir)
+    if cached and not needs_rebuild(new_manifest, cached.get("manifest")):
+        print(f"[{name}] Loaded cached index.")
+        shard = cached
+    else:
+        print(f"[{name}] Building index (this computes embeddings once)...")
+        index, chunks, meta, vectors = build_index(
+            pdfs, chunk_size=chunk_size, overlap=overlap, coarse_dim=coarse_dim
+        )
+        vectors = save_cache(cache_dir, index, chunks, meta, new_manifest, vectors)
+        print(f"[{name}] Index cached to {cache_dir}")
+        shard = {"index": index, "chunks": chunks, "meta": meta, "manifest": new_manifest, "vectors": vectors}
+    shard.update(name=name, folder=folder, doc_tags=load_doc_tags(folder))
+    return shard
+
 def _label(m):
     if isinstance(m, dict):
         t = m.get("title"); p = m.get("page")
@@ -96,7 +169,7 @@ def _label(m):
 
 def run_query(
     q,
-    index,
+    shards,
     chunks,
     meta,
     k=10,
@@ -105,20 +178,55 @@ def run_query(
     use_mmr=True,
     mmr_lambda=0.7,
     threshold=0.25,   # NEW knob
+    ids=None,
+    adaptive=True,
+    embed_fn=embed_queries,
+    session=None,
 ):
-    """Retrieve, optionally rerank, and generate an answer for a single query."""
-    # 1) recall + diversify
-    q_vec, picks = search_diverse(q, index, embed_queries, meta, fetch_k=fetch_k, per_file=per_file)
+    """Retrieve, optionally rerank, and generate an answer for a single query.
+
+    `shards` are the collections to search (see `load_collection`); `chunks`
+    and `meta` are the combined lists from `rag.combine_shards`. With
+    `adaptive`, `fetch_k` is only an upper bound: retrieval stops once enough
+    diversified candidates are found, or right away when it will abstain.
+    `embed_fn` can supply a query vector that was computed ahead of time.
+    With a `session` (see `session.py`), earlier evidence and turns are reused.
+    """
+    # MMR needs some headroom over k to diversify; plain top-k needs exactly k
+    target = (2 * k if use_mmr else k) if adaptive else None
+
+    # 1) recall (all selected shards in parallel) + diversify
+    q_vec, picks = search_shards(
+        retrieval_query(session, q) if session is not None else q,
+        shards, embed_fn, meta, fetch_k=fetch_k, per_file=per_file, ids=ids,
+        target=target, threshold=threshold,
+    )
 
     # --- ADD THIS BLOCK HERE ---
     scores = [s for s, _ in picks]
-    if not scores or max(scores) < threshold:
+    has_evidence = session is not None and bool(usable_ids(session, shards, ids))
+    if (not scores or max(scores) < threshold) and not has_evidence:
         print("\nQ:", q)
         print("\nA: I don't know based on the provided documents.")
         print("\nSources: (none above threshold)")
         return
     # ---------------------------
 
+    if session is not None:
+        # follow-up: merge with cached evidence, send only new sources
+        idxs = select_evidence(session, q_vec, picks, chunks, embed_texts, k, use_mmr, mmr_lambda,
+                               threshold=threshold, shards=shards, ids=ids)
+        prompt, new_ids, labels = build_turn_prompt(session, q, idxs, chunks, meta, _label)
+        ans = generate_answer(prompt, history=history(session))
+        record_turn(session, q, prompt, ans, new_ids)
+
+        print("\nQ:", q)
+        print("\nA:", ans)
+        print("\nSources:")
+        for lbl in labels:
+            print(" -", lbl)
+        return
+
     cand_idxs = [i for _, i in picks]
 
     # 2) rerank with MMR (if enabled)
@@ -144,40 +252,111 @@ def run_query(
     for lbl, _ in contexts:
         print(" -", lbl)
 
+def _pages_arg(spec):
+    """argparse `type=` for --pages: report bad specs as a usage error."""
+    try:
+        return parse_pages(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 def main():
     """CLI for interactive queries or one-shot question over local PDFs."""
+    D = load_defaults()  # rag_defaults.json (from tune.py) overrides the built-in defaults
     ap = argparse.ArgumentParser()
     ap.add_argument("--folder", default="pdfs")
-    ap.add_argument("--rebuild", action="store_true")
-    ap.add_argument("--chunk_size", type=int, default=500)
-    ap.add_argument("--overlap", type=int, default=100)
-    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--collections", nargs="+", default=None, metavar="FOLDER",
+                    help="several PDF folders, each indexed and cached as its own collection")
+    ap.add_argument("--search", default="", help="comma-separated collection names to query (default: all)")
+    ap.add_argument("--rebuild", nargs="*", default=None, metavar="NAME",
+                    help="rebuild all collections, or only the named ones")
+    ap.add_argument("--chunk_size", type=int, default=D["chunk_size"])
+    ap.add_argument("--overlap", type=int, default=D["overlap"])
+    ap.add_argument("--k", type=int, default=D["k"])
+    ap.add_argument("--fetch_k", type=int, default=D["fetch_k"], help="max FAISS candidates (upper bound when adaptive)")
+    ap.add_argument("--per_file", type=int, default=D["per_file"])
+    ap.add_argument("--mmr_lambda", type=float, default=D["mmr_lambda"])
+    ap.add_argument("--threshold", type=float, default=D["threshold"])
+    ap.add_argument("--no_adaptive", action="store_true", help="always fetch the full fetch_k")
+    ap.add_argument("--coarse_dim", type=int, default=0,
+                    help="truncated (Matryoshka) dim for a coarse first-pass index; 0 = full dim")
+    ap.add_argument("--files", default="", help="comma-separated filename substrings to restrict to")
+    ap.add_argument("--pages", default=None, type=_pages_arg, help="page ranges to restrict to, e.g. 1-10,15")
+    ap.add_argument("--tags", default="", help="comma-separated tags from <folder>/tags.json (all must match)")
+    ap.add_argument("--session", action="store_true",
+                    help="interactive follow-ups reuse earlier evidence and chat history (/new resets)")
     ap.add_argument("--ask_once", default="")  # optional one-shot question
     args = ap.parse_args()
+    if args.session and args.ask_once:
+        ap.error("--session is for the interactive loop; it cannot be combined with --ask_once")
 
-    print(f"Scanning {args.folder}, found {len(scan_pdfs(args.folder))} PDFs")
-    debug_list_models()
+    folders = args.collections or [args.folder]
+    names = [collection_name(f) for f in folders]
+    if len(set(names)) != len(names):
+        ap.error(f"collection names (folder basenames) must be unique: {names}")
 
-    pdfs = scan_pdfs(args.folder)
-    new_manifest = compute_manifest(pdfs, args.chunk_size, args.overlap)
-    new_manifest["digest"] = digest_manifest(new_manifest)
+    if args.coarse_dim < 0:
+        ap.error(f"--coarse_dim must be >= 0, got {args.coarse_dim}")
 
-    cached = None if args.rebuild else load_cached()
-    if cached and not needs_rebuild(new_manifest, cached.get("manifest")):
-        print("Loaded cached index.")
-        index, chunks, meta = cached["index"], cached["chunks"], cached["meta"]
-    else:
-        print("Building index (this computes embeddings once)...")
-        index, chunks, meta = build_index(pdfs, chunk_size=args.chunk_size, overlap=args.overlap)
-        save_cache(index, chunks, meta, new_manifest)
-        print("Index cached to ./.cache")
+    selected = [n.strip() for n in args.search.split(",") if n.strip()] or names
+    unknown = set(selected) - set(names)
+    if unknown:
+        ap.error(f"unknown collection(s) in --search: {sorted(unknown)}")
+    if args.rebuild:
+        unknown = set(args.rebuild) - set(names)
+        if unknown:
+            ap.error(f"unknown collection(s) in --rebuild: {sorted(unknown)}")
+        skipped = set(args.rebuild) - set(selected)
+        if skipped:
+            ap.error(f"--rebuild names collection(s) not in --search: {sorted(skipped)}")
+
+    debug_list_models_async()  # informational only; never blocks startup
+
+    with ThreadPoolExecutor(max_workers=len(selected) + 1) as pool:
+        # the one-shot question is embedded while the collections load
+        q_future = pool.submit(embed_queries, [args.ask_once]) if args.ask_once else None
+        futures = []
+        for folder, name in zip(folders, names):
+            if name not in selected:
+                continue  # never load (or rebuild) a collection we won't search
+            rebuild = args.rebuild is not None and (not args.rebuild or name in args.rebuild)
+            futures.append(pool.submit(
+                load_collection, folder, args.chunk_size, args.overlap, args.coarse_dim, rebuild
+            ))
+        try:
+            shards = [f.result() for f in futures]
+        except ValueError as e:  # e.g. --coarse_dim not below the model dimension
+            ap.error(str(e))
+        chunks, meta = combine_shards(shards)
+        print(f"Ready in {time.perf_counter() - T0:.2f}s ({len(shards)} collection(s), {len(chunks)} chunks)")
+
+    doc_tags = {}
+    for sh in shards:
+        doc_tags.update(sh["doc_tags"])
+    ids = filter_ids(
+        meta,
+        files=args.files.split(","),
+        pages=args.pages,
+        tags=args.tags.split(","),
+        doc_tags=doc_tags,
+    )
+    if ids is not None:
+        print(f"Filter active: {len(ids)} of {len(chunks)} chunks searchable.")
+
+    opts = dict(
+        k=args.k, fetch_k=args.fetch_k, per_file=args.per_file, mmr_lambda=args.mmr_lambda,
+        threshold=args.threshold, ids=ids, adaptive=not args.no_adaptive,
+    )
 
     if args.ask_once:
-        run_query(args.ask_once, index, chunks, meta, k=args.k)
+        run_query(args.ask_once, shards, chunks, meta, embed_fn=lambda _: q_future.result(), **opts)
+        print(f"\nFirst answer after {time.perf_counter() - T0:.2f}s")
         return
 
     # Interactive loop
+    session = new_session() if args.session else None
     print("\nType your query (or just press Enter to exit):")
+    if session is not None:
+        print("Session mode: follow-ups build on earlier answers; type /new to start over.")
     while True:
         try:
             q = input("ask> ").strip()
@@ -185,7 +364,11 @@ def main():
             break
         if not q:
             break
-        run_query(q, index, chunks, meta, k=args.k)
+        if session is not None and q == "/new":
+            session = new_session()
+            print("New session.")
+            continue
+        run_query(q, shards, chunks, meta, session=session, **opts)
 
 if __name__ == "__main__":
     main()
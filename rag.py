@@ -2,46 +2,334 @@
 Retrieval and prompt construction utilities for clinical Q&A.
 
 Functions:
-- `search_diverse`: Retrieve top candidates from FAISS and diversify across files.
+- `search_diverse`: Retrieve top candidates from FAISS and diversify across files
+  (optionally two-stage: coarse truncated index, then full-dimension rescoring;
+  optionally adaptive: start with a small k, widen only when needed, and stop
+  early when the best hit is already below the abstain threshold).
+- `combine_shards` / `search_shards`: Search several independently cached collections
+  in parallel and merge their hits into one ranked list before diversification.
+- `filter_ids` / `parse_pages`: Resolve file/page/tag filters to chunk ids that are
+  applied inside the FAISS search (ID selector), not after it.
 - `mmr`: Re-rank candidates with embedding-only Maximal Marginal Relevance.
 - `make_prompt`: Build the user message with SOURCES for the chat model.
+- `make_followup_prompt`: Follow-up turn of a session (see `session.py`): only new
+  SOURCES are sent, earlier ones stay in the conversation prefix.
+- `load_defaults`: Retrieval defaults shared by the CLI and the UI, optionally
+  overridden by `rag_defaults.json` (written by `tune.py`).
 
 Notes:
 - Designed to surface page‑level evidence for autoimmune liver diseases (AIH, PBC, PSC).
 - The app can abstain ("I don't know") based on a similarity threshold.
 
 Inputs/Outputs align with `ingest.build_index` artifacts and `embedder_lms`.
+`faiss` is only imported when an ID selector is needed; searches go through the
+already-loaded index objects, so importing this module stays cheap.
 """
 
-import faiss, numpy as np
+import os
+import json
+import numpy as np
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from embedder_lms import truncate_vectors
 
-def search_diverse(query, index, embed_fn, meta, fetch_k=80, per_file=2):
+DEFAULTS_PATH = "rag_defaults.json"
+DEFAULTS = {
+    "chunk_size": 500,
+    "overlap": 100,
+    "k": 3,
+    "fetch_k": 80,
+    "per_file": 2,
+    "mmr_lambda": 0.7,
+    "threshold": 0.25,
+}
+
+def load_defaults(path=DEFAULTS_PATH):
+    """`DEFAULTS` updated with the known keys from `path` (if it exists)."""
+    d = dict(DEFAULTS)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            tuned = json.load(f)
+        d.update({key: type(DEFAULTS[key])(v) for key, v in tuned.items() if key in DEFAULTS})
+    return d
+
+def _normalize(X):
+    """In-place L2 row normalization (same as `faiss.normalize_L2`)."""
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    X /= norms
+    return X
+
+def _rescore(q, I, vectors):
+    """Re-rank coarse hits `I` by exact similarity against full-dimension `vectors`."""
+    ids = I[0][I[0] != -1]
+    if len(ids) == 0:
+        return np.zeros((1, 0), dtype="float32"), np.zeros((1, 0), dtype="int64")
+    sims = np.asarray(vectors[ids], dtype="float32") @ q[0]
+    order = np.argsort(-sims, kind="stable")
+    return sims[order][None, :], ids[order][None, :]
+
+def parse_pages(spec):
+    """Parse a page spec like "1-5, 9" into [(1, 5), (9, 9)]; empty spec -> None.
+
+    Raises ValueError naming the offending part for anything else.
+    """
+    ranges = []
+    for part in (spec or "").replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, sep, hi = part.partition("-")
+        try:
+            lo = int(lo)
+            hi = int(hi) if sep else lo
+        except ValueError:
+            raise ValueError(f"invalid page range {part!r} (expected e.g. '1-5, 9')") from None
+        if lo < 1 or hi < 1:
+            raise ValueError(f"invalid page range {part!r} (pages start at 1)")
+        ranges.append((min(lo, hi), max(lo, hi)))
+    return ranges or None
+
+def filter_ids(meta, files=None, pages=None, tags=None, doc_tags=None):
+    """
+    Resolve metadata filters to the sorted chunk ids that satisfy all of them.
+    - files: filename substrings (case-insensitive); a chunk matches any of them
+    - pages: list of inclusive (lo, hi) page ranges, see `parse_pages`
+    - tags: tags a document must ALL carry, looked up in `doc_tags`
+      ({basename: [tags]}, see `ingest.load_doc_tags`)
+    Returns None when no filter is set (search everything).
+    """
+    files = [f.strip().lower() for f in (files or []) if f.strip()]
+    tags = {t.strip().lower() for t in (tags or []) if t.strip()}
+    if not (files or pages or tags):
+        return None
+    doc_tags = doc_tags or {}
+
+    ids = []
+    for i, m in enumerate(meta):
+        title = m.get("title", "") if isinstance(m, dict) else str(m)
+        fname = os.path.basename(title)
+        if files and not any(f in fname.lower() for f in files):
+            continue
+        if tags and not tags.issubset(doc_tags.get(fname, ())):
+            continue
+        if pages:
+            p = m.get("page") if isinstance(m, dict) else None
+            if p is None or not any(lo <= p <= hi for lo, hi in pages):
+                continue
+        ids.append(i)
+    return np.asarray(ids, dtype="int64")
+
+def _search_index(q, index, fetch_k, vectors=None, ids=None):
+    """
+    Single FAISS search for an L2-normalized query `q`, returning (D, I).
+    - ids: optional chunk ids to restrict the search to (FAISS ID selector)
+    - vectors: see `search_diverse` (two-stage coarse search + rescoring)
+    """
+    params = None
+    if ids is not None:
+        if len(ids) == 0:
+            return np.zeros((1, 0), dtype="float32"), np.zeros((1, 0), dtype="int64")
+        import faiss
+
+        sel = faiss.IDSelectorBatch(ids)
+        params = faiss.SearchParameters(sel=sel)
+        fetch_k = min(fetch_k, len(ids))
+    if vectors is not None and index.d < q.shape[1]:
+        _, I = index.search(truncate_vectors(q, index.d), fetch_k, params=params)
+        return _rescore(q, I, vectors)
+    return index.search(q, fetch_k, params=params)
+
+def _searcher(q, index, fetch_k, vectors=None, ids=None):
+    """
+    `n -> (D, I)` for `_retrieve`. On a two-stage index the coarse pass and the
+    rescoring run once over `fetch_k` candidates and each round takes the top
+    `n` of that rescored list: a smaller coarse pool would miss hits that only
+    rank high at full dimension, so adaptive rounds never shrink it.
+    """
+    if vectors is None or index.d >= q.shape[1]:
+        return lambda n: _search_index(q, index, n, vectors=vectors, ids=ids)
+    D, I = _search_index(q, index, fetch_k, vectors=vectors, ids=ids)
+    return lambda n: (D[:, :n], I[:, :n])
+
+def _doc_count(meta, ids=None):
+    """Distinct documents among chunk `ids` (all of `meta` by default)."""
+    rows = meta if ids is None else (meta[i] for i in ids)
+    return len({m["title"] if isinstance(m, dict) else str(m) for m in rows})
+
+def _retrieve(search_fn, meta, fetch_k, per_file, target=None, threshold=None, total=None,
+              reachable=None):
+    """
+    Run `search_fn(n) -> (D, I)` and diversify the hits.
+    Without `target` this is a single search of `fetch_k`. With `target`, the
+    search starts at a small n and doubles (up to `fetch_k`, or `total`
+    searchable chunks) only while fewer than `target` diversified picks come
+    back. `target` is capped at `reachable` (`per_file` x searchable
+    documents), so a filter down to a few documents does not widen the search
+    for picks that cannot exist. With `threshold`, it stops after the first round when the best hit
+    is below it, since the caller will abstain anyway.
+    """
+    if not target:
+        D, I = search_fn(fetch_k)
+        return _diversify(D, I, meta, per_file)
+
+    if reachable is not None:
+        target = max(1, min(target, reachable))
+    limit = min(fetch_k, total) if total is not None else fetch_k
+    n = min(limit, max(2 * target, 8))
+    while True:
+        D, I = search_fn(n)
+        picks = _diversify(D, I, meta, per_file)
+        if threshold is not None and (not picks or picks[0][0] < threshold):
+            return picks  # early abstain: nothing can rank above the top hit
+        exhausted = int((I[0] != -1).sum()) < n
+        if len(picks) >= target or n >= limit or exhausted:
+            return picks
+        n = min(limit, n * 2)
+
+def search_diverse(query, index, embed_fn, meta, fetch_k=80, per_file=2, vectors=None, ids=None,
+                   target=None, threshold=None, n_docs=None):
+    """
+    Retrieve `fetch_k` candidates and keep at most `per_file` chunks per document.
+    - vectors: full-dimension doc vectors (array or memmap) when `index` is a
+      coarse index over truncated vectors; the first pass then runs on the
+      truncated query and the top `fetch_k` hits are rescored at full dimension
+      (also in adaptive mode, see `_searcher`).
+    - ids: restrict the search to these chunk ids (see `filter_ids`); the
+      filter is applied inside FAISS, so `fetch_k` needs no headroom for it.
+    - target: adaptive mode, number of diversified picks wanted; `fetch_k`
+      becomes the upper bound (see `_retrieve`).
+    - threshold: with `target`, return after the first round if the best hit
+      is below it (abstain early).
+    - n_docs: distinct documents in `index` (see `combine_shards`); caps the
+      adaptive target without scanning `meta` per query
+    """
     q = embed_fn([query]).astype("float32")
-    faiss.normalize_L2(q)
-    D, I = index.search(q, fetch_k)
+    _normalize(q)
+    total = index.ntotal if ids is None else len(ids)
+    reachable = None
+    if target:
+        docs = _doc_count(meta, ids) if ids is not None else n_docs
+        reachable = per_file * docs if docs is not None else None
+    picks = _retrieve(
+        _searcher(q, index, fetch_k, vectors=vectors, ids=ids),
+        meta, fetch_k, per_file, target=target, threshold=threshold, total=total,
+        reachable=reachable,
+    )
+    return q, picks  # return q (query vec) for MMR
 
+def _diversify(D, I, meta, per_file):
+    """Keep hits in rank order, at most `per_file` per document -> [(score, id)]."""
     picks, seen = [], defaultdict(int)
     for d, i in zip(D[0], I[0]):
         if i == -1:
             continue
         fname = meta[i]["title"] if isinstance(meta[i], dict) else str(meta[i])
         if seen[fname] < per_file:
-            picks.append((float(d), i))
+            picks.append((float(d), int(i)))
             seen[fname] += 1
-    return q, picks  # return q (query vec) for MMR
+    return picks
+
+def combine_shards(shards):
+    """
+    Give each shard a global id offset and return the combined (chunks, meta).
+    Shards are dicts with at least "index", "chunks", "meta" (and optional
+    "vectors"); global id = shard["offset"] + local id. Also records the
+    shard's distinct document count ("n_docs") once, for adaptive retrieval.
+    """
+    chunks, meta = [], []
+    for sh in shards:
+        sh["offset"] = len(chunks)
+        if "n_docs" not in sh:
+            sh["n_docs"] = _doc_count(sh["meta"])
+        chunks.extend(sh["chunks"])
+        meta.extend(sh["meta"])
+    return chunks, meta
+
+def search_shards(query, shards, embed_fn, meta, fetch_k=80, per_file=2, ids=None,
+                  target=None, threshold=None):
+    """
+    `search_diverse` over several shards (see `combine_shards`).
+    The query is embedded once; each shard is searched on a thread pool (FAISS
+    releases the GIL) and the hits are merged by score into one global ranking.
+    - meta: combined meta (global ids)
+    - ids: optional global chunk ids to restrict to (see `filter_ids`)
+    - target / threshold: adaptive retrieval, as in `search_diverse`
+    """
+    q = embed_fn([query]).astype("float32")
+    _normalize(q)
+
+    jobs = []
+    for sh in shards:
+        lo, hi = sh["offset"], sh["offset"] + sh["index"].ntotal
+        local = None
+        if ids is not None:
+            local = ids[(ids >= lo) & (ids < hi)] - lo
+            if len(local) == 0:
+                continue  # filter excludes this shard entirely
+        jobs.append((sh, local))
+
+    if not jobs:
+        return q, []
+    total = sum(sh["index"].ntotal if local is None else len(local) for sh, local in jobs)
+    reachable = None
+    if target:
+        if ids is not None:
+            reachable = per_file * _doc_count(meta, ids)
+        elif all("n_docs" in sh for sh, _ in jobs):
+            reachable = per_file * sum(sh["n_docs"] for sh, _ in jobs)
 
-def mmr(query_vec, cand_idxs, chunks, embed_texts, topn=5, lambda_mult=0.7):
+    pool = ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) if len(jobs) > 1 else None
+
+    def _make(job):
+        sh, local = job
+        return _searcher(q, sh["index"], fetch_k, vectors=sh.get("vectors"), ids=local)
+
+    def _one(job, search_fn, n):
+        sh, _ = job
+        D, I = search_fn(n)
+        keep = I[0] != -1
+        return D[0][keep], I[0][keep] + sh["offset"]
+
+    def _merged(n):
+        if pool:
+            results = list(pool.map(lambda js: _one(js[0], js[1], n), zip(jobs, searchers)))
+        else:
+            results = [_one(job, fn, n) for job, fn in zip(jobs, searchers)]
+        D = np.concatenate([d for d, _ in results])
+        I = np.concatenate([i for _, i in results])
+        order = np.argsort(-D, kind="stable")[:n]
+        return D[order][None, :], I[order][None, :]
+
+    try:
+        searchers = list(pool.map(_make, jobs)) if pool else [_make(job) for job in jobs]
+        picks = _retrieve(_merged, meta, fetch_k, per_file, target=target, threshold=threshold, total=total,
+                          reachable=reachable)
+    finally:
+        if pool:
+            pool.shutdown()
+    return q, picks
+
+def mmr(query_vec, cand_idxs, chunks, embed_texts, topn=5, lambda_mult=0.7, vec_cache=None):
     """
     MMR with embedding-only signals.
     - query_vec: shape (1, D) L2-normalized
     - cand_idxs: list[int]
+    - vec_cache: optional {chunk id: normalized vector}; only candidates missing
+      from it are embedded, and they are added to it (session reuse)
     """
     if not cand_idxs:
         return []
     # embed candidate chunks with the SAME embedder used for docs
-    cand_vecs = embed_texts([chunks[i] for i in cand_idxs]).astype("float32")
-    faiss.normalize_L2(cand_vecs)
+    if vec_cache is None:
+        cand_vecs = embed_texts([chunks[i] for i in cand_idxs]).astype("float32")
+        _normalize(cand_vecs)
+    else:
+        missing = [i for i in dict.fromkeys(cand_idxs) if i not in vec_cache]
+        if missing:
+            new_vecs = _normalize(embed_texts([chunks[i] for i in missing]).astype("float32"))
+            vec_cache.update(zip(missing, new_vecs))
+        cand_vecs = np.stack([vec_cache[i] for i in cand_idxs])
 
     selected = []
     remaining = list(range(len(cand_idxs)))
@@ -61,11 +349,10 @@ def mmr(query_vec, cand_idxs, chunks, embed_texts, topn=5, lambda_mult=0.7):
 
     return [cand_idxs[j] for j in selected]
 
-def make_prompt(query, contexts, max_context_chars=9000, per_snippet_max=1500):
+def format_sources(contexts, max_context_chars=9000, per_snippet_max=1500):
     """
-    Build the LLM prompt (user message) from query + retrieved contexts.
-    `contexts` is a list of (label, text) tuples, where label typically looks
-    like "filename.pdf (p.X)" and text is the chunk content.
+    Render (label, text) contexts as SOURCES blocks within a character budget.
+    Returns (text, n_used): how many leading contexts fit.
     """
     chunks = []
     total = 0
@@ -76,8 +363,15 @@ def make_prompt(query, contexts, max_context_chars=9000, per_snippet_max=1500):
             break
         chunks.append(block)
         total += len(block)
+    return "".join(chunks), len(chunks)
 
-    ctx = "".join(chunks)
+def make_prompt(query, contexts, max_context_chars=9000, per_snippet_max=1500):
+    """
+    Build the LLM prompt (user message) from query + retrieved contexts.
+    `contexts` is a list of (label, text) tuples, where label typically looks
+    like "filename.pdf (p.X)" and text is the chunk content.
+    """
+    ctx, _ = format_sources(contexts, max_context_chars, per_snippet_max)
     return f"""Answer the question strictly based on the SOURCES below.
 If different sources say different things, list them separately with their labels.
 Do not merge or invent information. If insufficient information is present, say you don't know.
@@ -87,3 +381,27 @@ Question: {query}
 SOURCES:
 {ctx}
 Answer:"""
+
+def make_followup_prompt(query, new_ctx, reused_labels=()):
+    """
+    User message for a follow-up turn in a session. `new_ctx` is the already
+    rendered SOURCES text (see `format_sources`) for evidence not sent before;
+    SOURCES from earlier turns stay valid and are referenced by label, so the
+    conversation prefix (system prompt + earlier turns) is unchanged and the
+    server can reuse its prompt cache.
+    """
+    reused = "\n".join(f"- [{lbl}]" for lbl in reused_labels) or "- (none)"
+    new_block = new_ctx or "(no new sources)\n"
+    return f"""Follow-up question. The SOURCES given earlier in this conversation still apply;
+these earlier sources are most relevant here:
+{reused}
+
+Answer strictly from the SOURCES (earlier and new). If different sources say different
+things, list them separately with their labels. If insufficient information is present,
+say you don't know.
+
+Question: {query}
+
+NEW SOURCES:
+{new_block}
+Answer:"""
@@ -0,0 +1,120 @@
+"""
+Conversation sessions: reuse retrieved evidence across follow-up questions.
+
+A session is a plain dict kept per conversation:
+- `turns`: earlier exchanges `{"user", "assistant", "ids"}`, replayed as chat
+  history so the system prompt and earlier SOURCES form a stable prefix that
+  LM Studio can serve from its prompt cache. Turns are never dropped one by
+  one (that would change the prefix every turn); when the history reaches
+  `max_turns` or `max_chars`, the session rolls over and the next turn starts
+  a fresh history, re-sending its evidence as SOURCES.
+- `vecs`: `{chunk id: normalized vector}` for every chunk MMR has embedded, so a
+  follow-up never re-embeds evidence it already has.
+- `last_query`: the previous question, prepended to a follow-up for retrieval
+  ("and in pregnancy?" alone retrieves poorly).
+
+Chunk ids are global ids over the loaded collections (`rag.combine_shards`);
+start a new session whenever the index is rebuilt or reloaded.
+
+Used by `main.py --session` and the follow-up mode in `gradio_app.py`.
+"""
+
+import numpy as np
+
+from rag import mmr, format_sources, make_prompt, make_followup_prompt
+
+def new_session(max_turns=6, max_chars=24000):
+    """
+    Empty session. The replayed history is kept under `max_turns` exchanges and
+    `max_chars` characters (history plus the new prompt; ~6k tokens, so it fits
+    the context of a small local model).
+    """
+    return {"turns": [], "vecs": {}, "last_query": None, "max_turns": max_turns, "max_chars": max_chars}
+
+def shown_ids(session):
+    """Chunk ids already sent to the model in the replayed turns, in order."""
+    return [i for t in session["turns"] for i in t["ids"]]
+
+def retrieval_query(session, query):
+    """Text to embed for retrieval: a follow-up carries the previous question."""
+    if session["last_query"]:
+        return f"{session['last_query']}\n{query}"
+    return query
+
+def history(session):
+    """Earlier turns as chat messages for `llm_lms.generate_answer`."""
+    msgs = []
+    for t in session["turns"]:
+        msgs.append({"role": "user", "content": t["user"]})
+        msgs.append({"role": "assistant", "content": t["assistant"]})
+    return msgs
+
+def usable_ids(session, shards=None, ids=None):
+    """
+    Shown chunk ids that are still searchable: inside one of `shards` (see
+    `rag.combine_shards`) and in the `ids` filter (see `rag.filter_ids`), so a
+    filter or collection change mid-conversation also applies to old evidence.
+    """
+    shown = shown_ids(session)
+    if shards is not None:
+        shown = [i for i in shown
+                 if any(sh["offset"] <= i < sh["offset"] + sh["index"].ntotal for sh in shards)]
+    if ids is not None and shown:
+        shown = [i for i, ok in zip(shown, np.isin(shown, ids)) if ok]
+    return shown
+
+def select_evidence(session, q_vec, picks, chunks, embed_texts, k, use_mmr=True, lambda_mult=0.7,
+                    threshold=None, shards=None, ids=None):
+    """
+    Merge this turn's hits with the evidence of earlier turns and pick `k`.
+    Hits below `threshold` are dropped first (a follow-up may lean on earlier
+    evidence, but must not bring in new sources the threshold rejects), and
+    earlier evidence must still pass `shards`/`ids` (see `usable_ids`).
+    With MMR the cached vectors are reused; only new candidates are embedded.
+    """
+    cand = [i for s, i in picks if threshold is None or s >= threshold]
+    seen = set(cand)
+    cand += [i for i in usable_ids(session, shards, ids) if i not in seen]
+    if use_mmr:
+        return mmr(q_vec, cand, chunks, embed_texts, topn=k, lambda_mult=lambda_mult,
+                   vec_cache=session["vecs"])
+    return cand[:k]
+
+def history_chars(session):
+    """Size of the replayed history in characters."""
+    return sum(len(t["user"]) + len(t["assistant"]) for t in session["turns"])
+
+def build_turn_prompt(session, query, idxs, chunks, meta, label_fn):
+    """
+    User message for this turn. Evidence already in the conversation is
+    referenced by label; only unseen chunks are sent as new SOURCES.
+    If the history plus this prompt would exceed the session limits, the
+    history is cleared first (see module docstring; cached vectors are kept).
+    Returns (prompt, new_ids, labels) where `new_ids` are the chunks sent now.
+    """
+    prompt, new, labels = _turn_prompt(session, query, idxs, chunks, meta, label_fn)
+    if session["turns"] and (len(session["turns"]) >= session["max_turns"]
+                             or history_chars(session) + len(prompt) > session["max_chars"]):
+        session["turns"] = []
+        prompt, new, labels = _turn_prompt(session, query, idxs, chunks, meta, label_fn)
+    return prompt, new, labels
+
+def _turn_prompt(session, query, idxs, chunks, meta, label_fn):
+    shown = set(shown_ids(session))
+    new = [i for i in idxs if i not in shown]
+    reused = [i for i in idxs if i in shown]
+    new_ctx = [(label_fn(meta[i]), chunks[i]) for i in new]
+    ctx, n_used = format_sources(new_ctx)
+    new = new[:n_used]
+
+    if not session["turns"]:
+        prompt = make_prompt(query, new_ctx[:n_used])
+    else:
+        prompt = make_followup_prompt(query, ctx, [label_fn(meta[i]) for i in reused])
+    labels = [label_fn(meta[i]) for i in reused + new]
+    return prompt, new, labels
+
+def record_turn(session, query, prompt, answer, new_ids):
+    """Append the finished exchange (limits are applied by `build_turn_prompt`)."""
+    session["turns"].append({"user": prompt, "assistant": answer, "ids": list(new_ids)})
+    session["last_query"] = query
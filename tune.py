@@ -0,0 +1,257 @@
+"""
+Offline retrieval tuning: sweep retrieval parameters against labelled questions.
+
+Input (`--labels`): JSON list or JSONL of
+    {"question": "...", "expected": [{"file": "PIIS0168827817301861", "page": 12}, ...]}
+`file` is matched as a case-insensitive substring of the PDF basename; omit
+`page` to accept any page of that file. An empty `expected` list marks a
+question the documents cannot answer (the right outcome is to abstain).
+
+For every (chunk_size, overlap) the index is built once and cached under
+`.cache/tune/cs<size>_ov<overlap>/`, except the chunking the production cache
+`.cache/<collection>/` was built with, which is loaded from there; question
+vectors and MMR candidate vectors are embedded once and reused, so each grid
+point only costs local compute.
+
+Reported per configuration:
+- recall@k: share of expected pages among the k final contexts (answerable questions;
+  an abstention counts as zero recall)
+- correct_abstain: share of unanswerable questions that abstained (1.0 if there are none)
+- false_abstain: share of answerable questions that abstained
+- lat_ms: mean per-query retrieval latency, estimated as local compute plus the
+  live cost of embedding MMR candidates (measured per text, per chunking, while
+  filling the cache)
+- cands: mean candidates handed to MMR; prompt: mean prompt size in characters
+
+Pareto-optimal points (recall and correct abstentions up; false abstentions,
+latency and prompt size down) are marked `*`, and one is recommended; `--write_defaults` stores it in `rag_defaults.json`,
+which `main.py` and `gradio_app.py` use as their defaults.
+"""
+
+import argparse, csv, itertools, json, os, time
+
+from main import (
+    CACHE_DIR, cache_paths, collection_name, scan_pdfs, compute_manifest, digest_manifest, needs_rebuild,
+    load_collection, _label,
+)
+from embedder_lms import embed_queries, embed_texts
+from rag import search_shards, combine_shards, mmr, make_prompt, DEFAULTS, DEFAULTS_PATH, load_defaults
+
+def load_labels(path):
+    """Read labelled questions from a JSON list or a JSONL file."""
+    with open(path, "r") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def _matches(e, m):
+    fname = os.path.basename(m.get("title", "")).lower()
+    return e["file"].lower() in fname and (e.get("page") is None or e["page"] == m.get("page"))
+
+def evaluate(items, shards, chunks, meta, qvecs, vec_cache, embed_cost, cfg, adaptive=True):
+    """
+    Run every labelled question for one configuration; return the aggregate row.
+    Time spent embedding cache misses is excluded from `local_ms` and tallied in
+    `embed_cost` instead, so rows evaluated later are not cheaper by accident.
+    """
+    k = cfg["k"]
+    target = 2 * k if adaptive else None
+    recalls, local_ms, cands, prompt_chars = [], [], [], []
+    abstained = {True: 0, False: 0}  # by answerable
+
+    for item in items:
+        q = item["question"]
+        t0 = time.perf_counter()
+        net = [0.0]  # time spent in embedding calls (cache misses), excluded below
+
+        def _embed_misses(texts):
+            t = time.perf_counter()
+            X = embed_texts(texts)
+            net[0] += time.perf_counter() - t
+            embed_cost["texts"] += len(texts)
+            embed_cost["secs"] += time.perf_counter() - t
+            return X
+
+        q_vec, picks = search_shards(
+            q, shards, lambda _: qvecs[q][None, :], meta, fetch_k=cfg["fetch_k"], per_file=cfg["per_file"],
+            target=target, threshold=cfg["threshold"],
+        )
+        scores = [s for s, _ in picks]
+        expected = item.get("expected") or []
+        if not scores or max(scores) < cfg["threshold"]:
+            abstained[bool(expected)] += 1
+            idxs, cand = [], []
+        else:
+            cand = [i for _, i in picks]
+            idxs = mmr(q_vec, cand, chunks, _embed_misses, topn=k,
+                       lambda_mult=cfg["mmr_lambda"], vec_cache=vec_cache)
+        local_ms.append((time.perf_counter() - t0 - net[0]) * 1000)
+        cands.append(len(cand))
+
+        contexts = [(_label(meta[i]), chunks[i]) for i in idxs]
+        prompt_chars.append(len(make_prompt(q, contexts)) if contexts else 0)
+
+        if expected:
+            hit = sum(any(_matches(e, meta[i]) for i in idxs) for e in expected)
+            recalls.append(hit / len(expected))
+
+    n = len(items)
+    n_unanswerable = n - len(recalls)
+    return dict(
+        cfg,
+        recall=sum(recalls) / len(recalls) if recalls else 0.0,
+        correct_abstain=abstained[False] / n_unanswerable if n_unanswerable else 1.0,
+        false_abstain=abstained[True] / len(recalls) if recalls else 0.0,
+        local_ms=sum(local_ms) / n,
+        cands=sum(cands) / n,
+        prompt=sum(prompt_chars) / n,
+    )
+
+# Pareto objectives: +1 higher is better, -1 lower is better
+OBJECTIVES = {"recall": 1, "correct_abstain": 1, "false_abstain": -1, "lat_ms": -1, "prompt": -1}
+
+def pareto(rows):
+    """Mark rows not dominated on `OBJECTIVES`."""
+    def _dominates(o, r):
+        return (all(sign * o[c] >= sign * r[c] for c, sign in OBJECTIVES.items())
+                and any(sign * o[c] > sign * r[c] for c, sign in OBJECTIVES.items()))
+
+    for r in rows:
+        r["pareto"] = not any(_dominates(o, r) for o in rows)
+    return rows
+
+def recommend(rows, tolerance=0.02, abstain_tolerance=0.1):
+    """
+    Cheapest Pareto point whose recall is within `tolerance` of the best and
+    whose correct-abstain rate is within `abstain_tolerance` of the best among
+    those (answering unanswerable questions is a constraint, not free).
+    """
+    front = [r for r in rows if r["pareto"]]
+    best = max(r["recall"] for r in front)
+    ok = [r for r in front if r["recall"] >= best - tolerance]
+    best_abstain = max(r["correct_abstain"] for r in ok)
+    ok = [r for r in ok if r["correct_abstain"] >= best_abstain - abstain_tolerance]
+    return min(ok, key=lambda r: (r["lat_ms"], r["prompt"], -r["recall"]))
+
+def _ints(s): return [int(x) for x in s.split(",") if x.strip()]
+def _floats(s): return [float(x) for x in s.split(",") if x.strip()]
+
+def _grid_arg(ap, name, value, parse):
+    """Parse one comma-separated grid argument; empty or malformed lists are usage errors."""
+    try:
+        values = parse(value)
+    except ValueError:
+        ap.error(f"--{name}: expected comma-separated numbers, got {value!r}")
+    if not values:
+        ap.error(f"--{name}: needs at least one value")
+    return values
+
+def _cache_root(folder, chunk_size, overlap):
+    """Production cache root if it already holds this chunking (full dim), else a tune directory."""
+    m = compute_manifest(scan_pdfs(folder), chunk_size, overlap)
+    m["digest"] = digest_manifest(m)
+    path = cache_paths(os.path.join(CACHE_DIR, collection_name(folder)))["manifest"]
+    existing = None
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            existing = json.load(f)
+    if not needs_rebuild(m, existing):
+        return CACHE_DIR
+    return os.path.join(CACHE_DIR, "tune", f"cs{chunk_size}_ov{overlap}")
+
+def main():
+    """CLI: sweep the grid, print the table, recommend (and optionally write) defaults."""
+    D = load_defaults()
+    ap = argparse.ArgumentParser(description="Sweep retrieval parameters against labelled questions.")
+    ap.add_argument("--labels", required=True, help="JSON/JSONL of {question, expected:[{file, page}]}")
+    ap.add_argument("--folder", default="pdfs")
+    ap.add_argument("--collections", nargs="+", default=None, metavar="FOLDER")
+    ap.add_argument("--chunk_size", default=str(D["chunk_size"]), help="comma-separated values to sweep")
+    ap.add_argument("--overlap", default=str(D["overlap"]))
+    ap.add_argument("--k", default="3,5")
+    ap.add_argument("--fetch_k", default="20,40,80")
+    ap.add_argument("--per_file", default="1,2,3")
+    ap.add_argument("--mmr_lambda", default="0.5,0.7,0.9")
+    ap.add_argument("--threshold", default="0.2,0.25,0.3")
+    ap.add_argument("--no_adaptive", action="store_true", help="sweep with the full fetch_k every time")
+    ap.add_argument("--tolerance", type=float, default=0.02, help="recall slack when picking the cheapest point")
+    ap.add_argument("--abstain_tolerance", type=float, default=0.1,
+                    help="correct-abstain slack on unanswerable questions when picking the point")
+    ap.add_argument("--csv", default="", help="also write all rows to this CSV file")
+    ap.add_argument("--write_defaults", action="store_true", help=f"write the recommendation to {DEFAULTS_PATH}")
+    args = ap.parse_args()
+    sizes = _grid_arg(ap, "chunk_size", args.chunk_size, _ints)
+    overlaps = _grid_arg(ap, "overlap", args.overlap, _ints)
+    grid = list(itertools.product(
+        _grid_arg(ap, "k", args.k, _ints), _grid_arg(ap, "fetch_k", args.fetch_k, _ints),
+        _grid_arg(ap, "per_file", args.per_file, _ints),
+        _grid_arg(ap, "mmr_lambda", args.mmr_lambda, _floats),
+        _grid_arg(ap, "threshold", args.threshold, _floats),
+    ))
+
+    items = load_labels(args.labels)
+    if not items:
+        ap.error(f"no labelled questions in {args.labels}")
+    folders = args.collections or [args.folder]
+    n_unanswerable = sum(1 for it in items if not it.get("expected"))
+    print(f"{len(items)} labelled questions ({n_unanswerable} unanswerable), "
+          f"collections: {[collection_name(f) for f in folders]}")
+    if not n_unanswerable:
+        print("No unanswerable questions (empty `expected`): threshold is only tuned against false abstentions.")
+
+    # question vectors do not depend on chunking: embed them once
+    questions = [it["question"] for it in items]
+    qvecs = dict(zip(questions, embed_queries(questions)))
+
+    embed_cost = {}  # {(chunk_size, overlap): {"texts", "secs"}}: text length differs per chunking
+    rows = []
+    for cs, ov in itertools.product(sizes, overlaps):
+        shards = [load_collection(f, cs, ov, cache_root=_cache_root(f, cs, ov)) for f in folders]
+        chunks, meta = combine_shards(shards)
+        vec_cache = {}  # MMR candidate vectors, shared by all grid points of this chunking
+        cost = embed_cost[(cs, ov)] = {"texts": 0, "secs": 0.0}
+        for k, fetch_k, per_file, lam, thr in grid:
+            cfg = dict(chunk_size=cs, overlap=ov, k=k, fetch_k=fetch_k, per_file=per_file,
+                       mmr_lambda=lam, threshold=thr)
+            rows.append(evaluate(items, shards, chunks, meta, qvecs, vec_cache, cost, cfg,
+                                 adaptive=not args.no_adaptive))
+
+    # live latency estimate: local compute + MMR candidates at the per-text embed cost
+    # measured for that chunking (the overall mean if it embedded nothing)
+    texts = sum(c["texts"] for c in embed_cost.values())
+    mean_ms = 1000 * sum(c["secs"] for c in embed_cost.values()) / texts if texts else 0.0
+    per_text_ms = {key: 1000 * c["secs"] / c["texts"] if c["texts"] else mean_ms for key, c in embed_cost.items()}
+    for r in rows:
+        r["lat_ms"] = r["local_ms"] + r["cands"] * per_text_ms[(r["chunk_size"], r["overlap"])]
+    for (cs, ov), ms in per_text_ms.items():
+        print(f"Embedding cost cs={cs} ov={ov}: {ms:.1f} ms per candidate text "
+              f"({embed_cost[(cs, ov)]['texts']} embedded)")
+    pareto(rows)
+    rows.sort(key=lambda r: (-r["recall"], r["lat_ms"]))
+    cols = list(DEFAULTS) + ["recall", "correct_abstain", "false_abstain", "lat_ms", "cands", "prompt"]
+    print("\n  " + " ".join(f"{c:>10}" for c in cols))
+    for r in rows:
+        cells = [f"{r[c]:>10.3f}" if isinstance(r[c], float) else f"{r[c]:>10}" for c in cols]
+        print(("* " if r["pareto"] else "  ") + " ".join(cells))
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=cols + ["pareto"])
+            w.writeheader()
+            w.writerows({c: r[c] for c in cols + ["pareto"]} for r in rows)
+        print(f"\nRows written to {args.csv}")
+
+    best = recommend(rows, args.tolerance, args.abstain_tolerance)
+    chosen = {key: best[key] for key in DEFAULTS}
+    print("\nRecommended defaults:", json.dumps(chosen))
+    print(f"  recall@k={best['recall']:.3f} correct_abstain={best['correct_abstain']:.2f} "
+          f"false_abstain={best['false_abstain']:.2f} "
+          f"lat_ms={best['lat_ms']:.1f} prompt={best['prompt']:.0f} chars")
+    if args.write_defaults:
+        with open(DEFAULTS_PATH, "w") as f:
+            json.dump(chosen, f, indent=2)
+        print(f"Written to {DEFAULTS_PATH} (used by main.py and gradio_app.py)")
+
+if __name__ == "__main__":
+    main()